@@ -76,14 +76,16 @@ class DocType(DSLDocument):
         """
         return self.django.model._default_manager.all()
 
-    def get_indexing_queryset(self):
+    def get_indexing_queryset(self, chunk_size=None):
         """
-        Build queryset (iterator) for use by indexing.
+        Build queryset (iterator) for use by indexing. ``chunk_size`` overrides
+        ``queryset_pagination`` as the number of rows fetched at a time.
         """
         qs = self.get_queryset()
         kwargs = {}
-        if DJANGO_VERSION >= (2,) and self.django.queryset_pagination:
-            kwargs = {'chunk_size': self.django.queryset_pagination}
+        chunk_size = chunk_size or self.django.queryset_pagination
+        if DJANGO_VERSION >= (2,) and chunk_size:
+            kwargs = {'chunk_size': chunk_size}
         return qs.iterator(**kwargs)
 
     def init_prepare(self):
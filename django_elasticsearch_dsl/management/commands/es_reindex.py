@@ -1,18 +1,175 @@
 # from elasticsearch_dsl import Date, Text, Keyword, Document, connections
+# Standard libraries
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from functools import partial
+from itertools import chain
+from multiprocessing import cpu_count
+from threading import Event, Lock, Thread
+
 # Third party libraries
+from elasticsearch.exceptions import ConnectionTimeout, SerializationError
+from elasticsearch.serializer import JSONSerializer
 from elasticsearch_dsl import connections
-from elasticsearch.exceptions import NotFoundError
+from elasticsearch_dsl.serializer import AttrJSONSerializer
+from six import string_types
+from six.moves.queue import Full, Queue
 from django_elasticsearch_dsl.registries import registry
 
 # Django libraries
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections as db_connections
 from django.utils import timezone
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Number of chunks the prefetch thread may read ahead of the indexing
+PREFETCH_QUEUE_SIZE = 4
+# Chunk size of the elasticsearch bulk helpers, used when neither --chunk-size
+# nor the document's ``queryset_pagination`` are set
+DEFAULT_CHUNK_SIZE = 500
+
+# Index settings used while the new indexes are bulk loaded
+BULK_INDEX_SETTINGS = {
+    "refresh_interval": "-1",
+    "number_of_replicas": 0,
+    "translog.durability": "async",
+    "translog.flush_threshold_size": "1gb",
+}
+
+# Seconds to wait for the restored replicas to finish recovering before the aliases move
+REPLICA_RECOVERY_TIMEOUT = 60 * 60
+
+_prefetch_done = object()
+
+
+def _get_index_setting(index_settings, name):
+    """
+    Look up the dotted setting ``name`` in ``index_settings``, whether it is given
+    flat (``"translog.durability"``), nested (``{"translog": {"durability": ...}}``)
+    or a mix of both, with or without the ``index`` prefix. Returns ``None`` when
+    it isn't set.
+    """
+
+    def lookup(settings, parts):
+        for i in range(len(parts), 0, -1):
+            key = ".".join(parts[:i])
+            if key not in settings:
+                continue
+            if i == len(parts):
+                return settings[key]
+            if isinstance(settings[key], dict):
+                value = lookup(settings[key], parts[i:])
+                if value is not None:
+                    return value
+        return None
+
+    value = lookup(index_settings, name.split("."))
+    if value is None:
+        value = lookup(index_settings, ["index"] + name.split("."))
+    return value
+
+
+def _prefetch(iterable, chunk_size, queue_size=PREFETCH_QUEUE_SIZE):
+    """
+    Iterate over ``iterable`` from a feeder thread, which reads ahead up to
+    ``queue_size`` chunks of ``chunk_size`` items. Used on an indexing queryset
+    this lets the database fetch the next rows while the current ones are being
+    sent to elasticsearch. Errors raised by ``iterable`` are raised in the
+    consumer; the feeder stops when the consumer stops iterating.
+    """
+    chunks = Queue(maxsize=queue_size)
+    stop = Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def feed():
+        try:
+            chunk = []
+            for item in iterable:
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    if not put(chunk):
+                        return
+                    chunk = []
+            if chunk and not put(chunk):
+                return
+            put(_prefetch_done)
+        except Exception as e:
+            put(e)
+        finally:
+            # The feeder has its own database connection, don't leave it open
+            db_connections.close_all()
+
+    feeder = Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+    try:
+        while True:
+            # The feeder always ends with a sentinel or an error unless told to stop
+            chunk = chunks.get()
+            if chunk is _prefetch_done:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            for item in chunk:
+                yield item
+    finally:
+        stop.set()
+
+
+class ORJSONSerializer(JSONSerializer):
+    """
+    Wraps a JSONSerializer to encode with orjson, which is several times faster at
+    encoding bulk request bodies. Types orjson doesn't know about, such as ``AttrList``
+    or objects with ``to_dict()``, are still handled by the wrapped serializer's
+    ``default``.
+    """
+
+    def __init__(self, serializer):
+        self._serializer = serializer
+
+    def default(self, data):
+        return self._serializer.default(data)
+
+    def dumps(self, data):
+        # don't serialize strings
+        if isinstance(data, string_types):
+            return data
+
+        try:
+            return orjson.dumps(data, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except (ValueError, TypeError) as e:
+            raise SerializationError(data, e)
+
 
 class Command(BaseCommand):
     help = "Manage elasticsearch index."
 
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        self._stdout_lock = Lock()
+
+    def _write(self, msg):
+        """
+        Write to stdout, serialised so output from worker threads does not interleave
+        """
+        with self._stdout_lock:
+            self.stdout.write(msg)
+
     def add_arguments(self, parser):
         parser.add_argument(
             "--models",
@@ -34,6 +191,35 @@ class Command(BaseCommand):
             help="Manually refresh new indexes. Necessary if index.refresh_interval is set to -1",
         )
 
+        parser.add_argument(
+            "--no-bulk-index-settings",
+            action="store_false",
+            dest="bulk_index_settings",
+            help="Do not disable refresh and replicas on the new indexes while they are populated",
+        )
+
+        parser.add_argument(
+            "--no-force-merge",
+            action="store_false",
+            dest="force_merge",
+            help="Do not force merge the new indexes down to a single segment before updating the aliases",
+        )
+
+        parser.add_argument(
+            "--force-merge-timeout",
+            action="store",
+            type=int,
+            default=60 * 60,
+            help="Seconds to wait for the force merge before moving on to the aliases. Defaults to 3600",
+        )
+
+        parser.add_argument(
+            "--no-orjson",
+            action="store_false",
+            dest="orjson",
+            help="Do not use orjson to serialize bulk requests, even if it is installed",
+        )
+
         parser.add_argument(
             "--no-count",
             action="store_false",
@@ -43,7 +229,47 @@ class Command(BaseCommand):
         )
 
         parser.add_argument(
-            "--index-base-id", action="store", type=str, help="Use the supplied index-base-id for the index prefix"
+            "--parallel", action="store_true", dest="parallel", help="Run the bulk indexing multi threaded"
+        )
+
+        parser.add_argument(
+            "--no-parallel", action="store_false", dest="parallel", help="Run the bulk indexing single threaded"
+        )
+
+        parser.add_argument(
+            "--bulk-threads",
+            action="store",
+            type=int,
+            help="Number of threads used by parallel bulk indexing, for each document. "
+            "Defaults to ELASTICSEARCH_DSL_BULK_THREADS or the number of CPUs",
+        )
+
+        parser.add_argument(
+            "--bulk-queue-size",
+            action="store",
+            type=int,
+            help="Number of chunks queued up for the parallel bulk indexing threads. Defaults to 4",
+        )
+
+        parser.add_argument(
+            "--chunk-size",
+            action="store",
+            type=int,
+            help="Number of documents per bulk request. Defaults to the document's queryset_pagination, or 500",
+        )
+
+        parser.add_argument(
+            "--max-chunk-bytes",
+            action="store",
+            type=int,
+            help="Maximum size in bytes of a bulk request. Defaults to 100MB",
+        )
+
+        parser.add_argument(
+            "--index-base-id",
+            action="store",
+            type=str,
+            help="Use the supplied index-base-id for the index prefix. Defaults to the current timestamp",
         )
 
         parser.add_argument(
@@ -60,7 +286,9 @@ class Command(BaseCommand):
         )
         parser.set_defaults(
             parallel=getattr(settings, "ELASTICSEARCH_DSL_PARALLEL", False),
-            index_base_id=int(timezone.now().timestamp()),
+            concurrency=getattr(settings, "ELASTICSEARCH_DSL_REINDEX_CONCURRENCY", 12),
+            bulk_threads=getattr(settings, "ELASTICSEARCH_DSL_BULK_THREADS", None) or cpu_count(),
+            bulk_queue_size=4,
             alias_wildcard_pattern="_r_wildcard",
             alias_fixed_pattern="_r",
             wipe_old_indexes=True,
@@ -71,45 +299,77 @@ class Command(BaseCommand):
           Get Models from registry that match the --models args
           """
         if args:
-            models = []
-            for arg in args:
-                arg = arg.lower()
-                match_found = False
-
-                for model in registry.get_models():
-                    if model._meta.app_label == arg:
-                        models.append(model)
-                        match_found = True
-                    elif "{}.{}".format(model._meta.app_label.lower(), model._meta.model_name.lower()) == arg:
-                        models.append(model)
-                        match_found = True
-
-                if not match_found:
-                    raise CommandError("No model or app named {}".format(arg))
+            # Index the registry once by app label and by app.model label
+            available = defaultdict(set)
+            for model in registry.get_models():
+                app_label = model._meta.app_label.lower()
+                available[app_label].add(model)
+                available["{}.{}".format(app_label, model._meta.model_name.lower())].add(model)
+
+            requested = set(arg.lower() for arg in args)
+            # Report every unknown arg at once
+            missing = requested.difference(available)
+            if missing:
+                raise CommandError("No model or app named {}".format(", ".join(sorted(missing))))
+
+            models = chain.from_iterable(available[arg] for arg in requested)
         else:
             models = registry.get_models()
 
         return set(models)
 
-    def _create_index_templates(self, models, options):
+    def _create_index_templates(self, docs, options, bulk_load=False):
         """
         Create the index template in elasticsearch specifying the mappings and any
         settings to be used. This can be run at any time, ideally at every new code
         deploy.
+
+        With ``bulk_load`` the templates also carry ``BULK_INDEX_SETTINGS``, so that
+        indexes created while reindexing are tuned for bulk indexing.
+
+        Templates are uploaded concurrently, one request per document. Requests share
+        the connection pool of the elasticsearch client, so its ``maxsize`` should be
+        raised in ``ELASTICSEARCH_DSL`` to get the full benefit.
         """
-        index_base_id = options["index_base_id"]
-        for doc in registry.get_documents(models):
-            self.stdout.write("Creating index template for '{}'".format(doc._index._name))
+        if not docs:
+            return
+
+        create_index_template = partial(
+            self._create_index_template, index_base_id=options["index_base_id"], bulk_load=bulk_load
+        )
+        with ThreadPoolExecutor(max_workers=min(32, len(docs))) as executor:
+            # consume the results so that any exception is raised here
+            list(executor.map(create_index_template, docs))
 
-            pattern = "{0}-{1}-*".format(index_base_id, doc._index._name)
+    def _create_index_template(self, doc, index_base_id, bulk_load=False):
+        self._write("Creating index template for '{}'".format(doc._index._name))
 
-            # create/overwrite an index template
-            index_template = doc._index.as_template(doc._index._name, pattern)
-            # upload the template into elasticsearch
-            # potentially overriding the one already there
-            index_template.save()
+        pattern = "{0}-{1}-*".format(index_base_id, doc._index._name)
 
-    def _reindex_as_new(self, es, models, options):
+        # create/overwrite an index template
+        index_template = doc._index.as_template(doc._index._name, pattern)
+        if bulk_load:
+            # the template works on a copy of the index, the document is unaffected
+            index_template.settings(**BULK_INDEX_SETTINGS)
+        # upload the template into elasticsearch
+        # potentially overriding the one already there
+        index_template.save()
+
+    def _restore_index_settings(self, es, docs, indices, options):
+        """
+        Undo ``BULK_INDEX_SETTINGS`` once the new indexes are populated: put back the
+        regular templates, for indexes created from now on, and the regular settings
+        on the indexes just created
+        """
+        self._create_index_templates(docs, options)
+        for index in indices:
+            pattern = "{0}-{1}-*".format(options["index_base_id"], index._name)
+            self.stdout.write("Restoring index settings for '{}'".format(pattern))
+            # None resets a setting the index doesn't define, rather than pinning it to a value
+            index_settings = {name: _get_index_setting(index._settings, name) for name in BULK_INDEX_SETTINGS}
+            es.indices.put_settings(index=pattern, body={"index": index_settings})
+
+    def _reindex_as_new(self, es, docs, options):
         """
         reindex function that creates a new index for the data. Optionally it also can
         update the alias to point to the latest index (set ``update_alias=False`` to skip).
@@ -118,20 +378,77 @@ class Command(BaseCommand):
         any and all searches without any loss of functionality. It should, however,
         not perform any writes at this time as those might be lost.
 
+        Documents are indexed concurrently, up to ``ELASTICSEARCH_DSL_REINDEX_CONCURRENCY``
+        at a time.
         """
+        if not docs:
+            return
+
+        index_one = partial(self._index_one, options=options)
+        with ThreadPoolExecutor(max_workers=min(options["concurrency"], len(docs))) as executor:
+            # consume the results so that any exception is raised here
+            list(executor.map(index_one, docs))
+
+    def _index_one(self, doc, options):
+        # Each worker thread has its own database connection. Drop it if it went stale while
+        # the thread was idle, and close it once done, persistent (CONN_MAX_AGE) or not,
+        # rather than hold it while other documents are indexed
+        close_old_connections()
+        try:
+            self._index_doc(doc, options)
+        finally:
+            db_connections.close_all()
 
+    def _index_doc(self, doc, options):
         parallel = options["parallel"]
-        index_base_id = options["index_base_id"]
-        for doc in registry.get_documents(models):
-            self.stdout.write(
-                "Indexing {} '{}' objects {}".format(
-                    doc().get_queryset().count() if options["count"] else "all",
-                    doc.django.model.__name__,
-                    "(parallel)" if parallel else "",
-                )
-            )
-            qs = doc().get_indexing_queryset()
-            doc().update(qs, parallel=parallel, index_base_id=index_base_id)
+        # Build the document once, it prepares its fields on every instantiation
+        doc_instance = doc()
+        total = doc_instance.get_queryset().count() if options["count"] else "all"
+        self._write(
+            "Indexing {} '{}' objects {}".format(total, doc.django.model.__name__, "(parallel)" if parallel else "")
+        )
+        # Only override the bulk helper defaults when asked to
+        bulk_kwargs = {}
+        if options["chunk_size"]:
+            bulk_kwargs["chunk_size"] = options["chunk_size"]
+        if options["max_chunk_bytes"]:
+            bulk_kwargs["max_chunk_bytes"] = options["max_chunk_bytes"]
+        if parallel:
+            # parallel_bulk only, the serial bulk helper does not accept these
+            bulk_kwargs["thread_count"] = options["bulk_threads"]
+            bulk_kwargs["queue_size"] = options["bulk_queue_size"]
+
+        chunk_size = options["chunk_size"] or doc_instance.django.queryset_pagination or DEFAULT_CHUNK_SIZE
+        # Stream rows from the database in chunks of the bulk size, through a server side
+        # cursor where the database supports it, rather than loading the whole table
+        if options["chunk_size"]:
+            qs = doc_instance.get_indexing_queryset(chunk_size=options["chunk_size"])
+        else:
+            qs = doc_instance.get_indexing_queryset()
+        qs = _prefetch(qs, chunk_size)
+        if options["bulk_index_settings"]:
+            # Don't refresh after every chunk (the document's auto_refresh), the new indexes
+            # are refreshed once they are populated
+            bulk_kwargs["refresh"] = False
+        doc_instance.update(qs, parallel=parallel, index_base_id=options["index_base_id"], **bulk_kwargs)
+
+    @contextmanager
+    def _bulk_serializer(self, es, options):
+        """
+        Serialize requests with orjson while in this context, if it is installed
+        """
+        serializer = es.transport.serializer
+        # Only wrap the stock serializers, a serializer configured in ELASTICSEARCH_DSL
+        # may encode differently and is left alone
+        if not options["orjson"] or orjson is None or type(serializer) not in (JSONSerializer, AttrJSONSerializer):
+            yield
+            return
+
+        es.transport.serializer = ORJSONSerializer(serializer)
+        try:
+            yield
+        finally:
+            es.transport.serializer = serializer
 
     def _refresh_new_indexes(self, es, models, options):
         """
@@ -140,45 +457,122 @@ class Command(BaseCommand):
         pattern = "{0}-*".format(options["index_base_id"])
         es.indices.refresh(index=pattern)
 
-    def _update_alias(self, es, models, options):
+    def _force_merge_new_indexes(self, es, options):
+        """
+        Merge each newly created index down to a single segment. Costly, but they are not
+        serving searches yet and will not be written to much once live.
+        """
+        pattern = "{0}-*".format(options["index_base_id"])
+        self.stdout.write("Force merging indexes '{}'".format(pattern))
+        try:
+            es.indices.forcemerge(index=pattern, max_num_segments=1, request_timeout=options["force_merge_timeout"])
+        except ConnectionTimeout:
+            # The merge carries on in elasticsearch, don't leave the aliases unmoved for it
+            self.stderr.write("Timed out waiting for the force merge of indexes '{}', continuing".format(pattern))
+
+    def _wait_for_replicas(self, es, options):
+        """
+        Wait for the replicas restored on the new indexes to be recovered, so the aliases do
+        not move (and the old indexes get wiped) while the new ones have no replicas
+        """
+        pattern = "{0}-*".format(options["index_base_id"])
+        self.stdout.write("Waiting for the replicas of indexes '{}'".format(pattern))
+        timeout = "{}s".format(REPLICA_RECOVERY_TIMEOUT)
+        health = es.cluster.health(
+            index=pattern,
+            wait_for_no_initializing_shards=True,
+            timeout=timeout,
+            request_timeout=REPLICA_RECOVERY_TIMEOUT,
+            # elasticsearch answers 408 when the timeout is reached
+            ignore=408,
+        )
+        if health.get("timed_out"):
+            self.stderr.write("Timed out waiting for the replicas of indexes '{}'".format(pattern))
+
+    def _update_alias(self, es, indices, options):
         """
         Move the alias from the old index to the new index
         """
-        for index in registry.get_indices(models):
+        aliases = self._get_aliases(es)
+        for index in indices:
 
-            self._update_wildcard_indexes(es, index, options)
+            actions = self._update_wildcard_indexes(index, aliases, options)
             # Must be called second
-            self._update_fixed_indexes(es, index, options)
+            actions.extend(self._update_fixed_indexes(index, aliases, options))
+            if actions:
+                # The wildcard alias, the fixed aliases and the wipe of the old indexes all
+                # change in one atomic request, so no alias ever resolves to nothing.
+                # Wiping the old indexes goes last, only to read better.
+                actions.sort(key=lambda action: "remove_index" in action)
+                es.indices.update_aliases(body={"actions": actions})
+
+    def _get_aliases(self, es):
+        """
+        Fetch every index and its aliases in a single request, as ``{index: set(aliases)}``.
+        This snapshot stands in for per alias ``get_alias`` calls and is kept up to date
+        by ``_apply_alias_actions``.
+        """
+        return {index: set(data["aliases"]) for index, data in es.indices.get_alias().items()}
+
+    def _get_alias(self, aliases, name):
+        """
+        Return the indexes in the snapshot that have the alias ``name``. Like
+        ``es.indices.get_alias(name=name)`` it is an error for there to be none,
+        in which case ``KeyError`` is raised.
+        """
+        indexes = sorted(index for index, index_aliases in aliases.items() if name in index_aliases)
+        if not indexes:
+            raise KeyError(name)
+        return indexes
 
-    def _update_wildcard_indexes(self, es, index, options):
+    def _apply_alias_actions(self, aliases, actions):
+        """
+        Replay the alias ``actions`` on the snapshot, ahead of sending them to elasticsearch
+        """
+        for action in actions:
+            for action_type, params in action.items():
+                if action_type == "add":
+                    for index, index_aliases in aliases.items():
+                        if fnmatchcase(index, params["index"]):
+                            index_aliases.add(params["alias"])
+                elif action_type == "remove":
+                    for index in params["indices"]:
+                        aliases.get(index, set()).discard(params["alias"])
+                elif action_type == "remove_index":
+                    aliases.pop(params["index"], None)
+
+    def _update_wildcard_indexes(self, index, aliases, options):
+        """
+        Return the actions pointing the wildcard alias to the new indexes, applied to
+        the snapshot already
+        """
         pattern = "{0}-{1}-*".format(options["index_base_id"], index._name)
         alias = "{0}{1}".format(index._name, options["alias_wildcard_pattern"])
         self.stdout.write("Creating wildcard Alias {0} {1} for '{2}'".format(alias, pattern, index._name))
         try:
-            old_index_aliases = es.indices.get_alias(name=alias)
-            old_indexes = list(old_index_aliases.keys())
-            if old_indexes[0].startswith(str(options["index_base_id"])):
+            alias_indexes = self._get_alias(aliases, alias)
+        except KeyError:
+            alias_indexes = []
+
+        actions = [{"add": {"alias": alias, "index": pattern}}]
+        if alias_indexes:
+            # Leave alone any index the alias already has from this run
+            old_indexes = [
+                old_index for old_index in alias_indexes if not old_index.startswith(options["index_base_id_prefix"])
+            ]
+            if not old_indexes:
                 self.stdout.write("Old Indexes also match current index_base_id, skipping Alias update")
+                return []
+            if options["wipe_old_indexes"]:
+                # Removing an index also removes its aliases, fixed ones included
+                actions.extend({"remove_index": {"index": old_index}} for old_index in old_indexes)
             else:
+                actions.insert(0, {"remove": {"alias": alias, "indices": old_indexes}})
 
-                es.indices.update_aliases(
-                    body={
-                        "actions": [
-                            {"remove": {"alias": alias, "indices": old_indexes}},
-                            {"add": {"alias": alias, "index": pattern}},
-                        ]
-                    }
-                )
-                if options["wipe_old_indexes"]:
-                    if old_indexes[0].startswith(str(options["index_base_id"])):
-                        self.stdout.write("Old Indexes also match current index_base_id, skipping wipe_old_indexes")
-                    else:
-                        es.indices.delete(index=",".join(old_indexes))
-
-        except NotFoundError:
-            es.indices.update_aliases(body={"actions": [{"add": {"alias": alias, "index": pattern}},]})
+        self._apply_alias_actions(aliases, actions)
+        return actions
 
-    def _update_fixed_indexes(self, es, index, options):
+    def _update_fixed_indexes(self, index, aliases, options):
 
         """
             This function should create an alias for each individual index created during the indexing process
@@ -187,51 +581,79 @@ class Command(BaseCommand):
             = <index_base_id>-<index._name>-<doc.get_index_name>
 
             So we use the Newly created wildcard alias to get a list of indexes that need an alias
+
+            Returns the actions, applied to the snapshot already
         """
 
         w_alias = "{0}{1}".format(index._name, options["alias_wildcard_pattern"])
         self.stdout.write("Creating fixed Aliases for indexes found in {0} '{1}'".format(w_alias, index._name))
         try:
-            current_indexes_for_alias = es.indices.get_alias(name=w_alias)
-            current_indexes = list(current_indexes_for_alias.keys())
-
-            if not current_indexes[0].startswith(str(options["index_base_id"])):
-                self.stdout.write("Current Indexes don't match the current index_base_id, skipping Alias update")
-            else:
-
-                for current_index in current_indexes:
-                    index_postfix = current_index.replace("{0}-{1}".format(options["index_base_id"], index._name), "")
-                    alias = "{0}{1}{2}".format(index._name, options["alias_fixed_pattern"], index_postfix)
-                    self.stdout.write(
-                        "Creating fixed Alias {0} for {1} index {2}'".format(alias, index._name, current_index)
-                    )
-                    try:
-                        old_indexes_for_alias = es.indices.get_alias(name=alias)
-                        old_indexes = list(old_indexes_for_alias.keys())
-
-                        es.indices.update_aliases(
-                            body={
-                                "actions": [
-                                    {"remove": {"alias": alias, "indices": old_indexes}},
-                                    {"add": {"alias": alias, "index": current_index}},
-                                ]
-                            }
-                        )
-                    except NotFoundError:
-                        es.indices.update_aliases(
-                            body={"actions": [{"add": {"alias": alias, "index": current_index}},]}
-                        )
-        except NotFoundError:
-            self.stdout.write("No Existing indexes found for alias '{1}' - Not creating Fixed indexes".format(w_alias))
+            current_indexes = self._get_alias(aliases, w_alias)
+        except KeyError:
+            self.stdout.write("No Existing indexes found for alias '{0}' - Not creating Fixed indexes".format(w_alias))
+            return []
+
+        current_indexes = [
+            current_index
+            for current_index in current_indexes
+            if current_index.startswith(options["index_base_id_prefix"])
+        ]
+        actions = []
+        if not current_indexes:
+            self.stdout.write("Current Indexes don't match the current index_base_id, skipping Alias update")
+        else:
+            # Same for every index, build them once
+            index_prefix = "{0}-{1}".format(options["index_base_id"], index._name)
+            alias_prefix = "{0}{1}".format(index._name, options["alias_fixed_pattern"])
+            for current_index in current_indexes:
+                alias = alias_prefix + current_index.replace(index_prefix, "")
+                self.stdout.write(
+                    "Creating fixed Alias {0} for {1} index {2}'".format(alias, index._name, current_index)
+                )
+                try:
+                    old_indexes = self._get_alias(aliases, alias)
+                except KeyError:
+                    old_indexes = []
+                if old_indexes == [current_index]:
+                    # e.g. when re-running with the same index_base_id
+                    self.stdout.write("Fixed Alias {0} already points to {1}, skipping".format(alias, current_index))
+                    continue
+                if old_indexes:
+                    actions.append({"remove": {"alias": alias, "indices": old_indexes}})
+                actions.append({"add": {"alias": alias, "index": current_index}})
+            self._apply_alias_actions(aliases, actions)
+        return actions
 
     def handle(self, *args, **options):
+        # Defaults to the current time, taken here so that each run gets a fresh id
+        if options.get("index_base_id") is None:
+            options["index_base_id"] = int(timezone.now().timestamp())
+        # With the separator, so that e.g. id 12 doesn't claim the indexes of id 123
+        options["index_base_id_prefix"] = "{}-".format(options["index_base_id"])
         es = connections.get_connection()
         models = self._get_models(options["models"])
-        self._create_index_templates(models, options)
-        self._reindex_as_new(es, models, options)
+        # Resolve the registry once, every step below works on the same documents and indices
+        docs = list(registry.get_documents(models))
+        indices = list(registry.get_indices(models))
+
+        bulk_load = options["bulk_index_settings"]
+        self._create_index_templates(docs, options, bulk_load=bulk_load)
+        try:
+            with self._bulk_serializer(es, options):
+                self._reindex_as_new(es, docs, options)
+
+            # Refresh as well after a bulk load, the new indexes have not been refreshed yet
+            if options["refresh_new_indexes"] or bulk_load:
+                self._refresh_new_indexes(es, models, options)
 
-        if options["refresh_new_indexes"]:
-            self._refresh_new_indexes(es, models, options)
+            # Merge before the replicas are restored, so they copy the merged segments
+            if options["force_merge"]:
+                self._force_merge_new_indexes(es, options)
+        finally:
+            if bulk_load:
+                self._restore_index_settings(es, docs, indices, options)
 
         if options["alias"]:
-            self._update_alias(es, models, options)
+            if bulk_load:
+                self._wait_for_replicas(es, options)
+            self._update_alias(es, indices, options)
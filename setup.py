@@ -44,6 +44,7 @@ setup(
     install_requires=[
         'elasticsearch-dsl>=7.0.0<8.0.0',
         'six',
+        'futures>=3.0; python_version < "3"',
     ],
     license="Apache Software License 2.0",
     zip_safe=False,
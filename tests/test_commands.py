@@ -1,12 +1,25 @@
+import datetime
+from decimal import Decimal
 from mock import DEFAULT, Mock, patch
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
 from django.core.management.base import CommandError
 from django.core.management import call_command
+from elasticsearch.exceptions import ConnectionTimeout
+from elasticsearch_dsl import InnerDoc, Keyword
+from elasticsearch_dsl.serializer import AttrJSONSerializer
+from elasticsearch_dsl.utils import AttrList
 from six import StringIO
 
 from django_elasticsearch_dsl import Index
 from django_elasticsearch_dsl.management.commands.search_index import Command
+from django_elasticsearch_dsl.management.commands.es_reindex import (
+    BULK_INDEX_SETTINGS,
+    Command as EsReindexCommand,
+    _get_index_setting,
+    ORJSONSerializer,
+    orjson,
+)
 from django_elasticsearch_dsl.registries import DocumentRegistry
 
 from .fixtures import WithFixturesMixin
@@ -143,3 +156,450 @@ class SearchIndexTestCase(WithFixturesMixin, TestCase):
             handles['_delete'].assert_called()
             handles['_create'].assert_not_called()
             handles['_populate'].assert_not_called()
+
+
+class EsReindexTestCase(WithFixturesMixin, TestCase):
+    def setUp(self):
+        self.out = StringIO()
+        self.registry = DocumentRegistry()
+        self.index_a = Index('foo')
+        self.index_b = Index('bar')
+
+        self.doc_a1 = self._generate_doc_mock(self.ModelA, self.index_a, Mock())
+        self.doc_b1 = self._generate_doc_mock(self.ModelB, self.index_a, Mock())
+        self.doc_c1_qs = Mock()
+        self.doc_c1 = self._generate_doc_mock(self.ModelC, self.index_b, self.doc_c1_qs)
+
+        patch(
+            'django_elasticsearch_dsl.management.commands.es_reindex.registry', self.registry
+        ).start()
+        for index in [self.index_a, self.index_b]:
+            patch.object(index, 'as_template').start()
+        self.addCleanup(patch.stopall)
+
+        self.cmd = EsReindexCommand(stdout=self.out)
+        self.options = {
+            'index_base_id': 123,
+            'index_base_id_prefix': '123-',
+            'parallel': False,
+            'count': True,
+            'concurrency': 2,
+            'chunk_size': None,
+            'max_chunk_bytes': None,
+            'bulk_index_settings': True,
+            'bulk_threads': 8,
+            'bulk_queue_size': 4,
+            'orjson': True,
+            'force_merge_timeout': 60,
+            'alias_wildcard_pattern': '_r_wildcard',
+            'alias_fixed_pattern': '_r',
+            'wipe_old_indexes': True,
+        }
+
+    def test_get_models(self):
+        self.assertEqual(
+            self.cmd._get_models(['foo', 'bar.ModelC']),
+            set([self.ModelA, self.ModelB, self.ModelC])
+        )
+        self.assertEqual(self.cmd._get_models(['FOO.modela']), set([self.ModelA]))
+        self.assertEqual(
+            self.cmd._get_models([]),
+            set([self.ModelA, self.ModelB, self.ModelC])
+        )
+        with self.assertRaises(CommandError) as context:
+            self.cmd._get_models(['foo', 'unknown', 'bar.Other'])
+        self.assertEqual(
+            str(context.exception), "No model or app named bar.other, unknown"
+        )
+
+    def test_create_index_templates(self):
+        self.cmd._create_index_templates(
+            [self.doc_a1, self.doc_b1, self.doc_c1], self.options
+        )
+        self.assertEqual(self.index_a.as_template.call_count, 2)
+        self.index_a.as_template.assert_called_with('foo', '123-foo-*')
+        self.index_a.as_template.return_value.save.assert_called()
+        self.index_b.as_template.assert_called_once_with('bar', '123-bar-*')
+        self.index_b.as_template.return_value.save.assert_called_once()
+        self.assertEqual(self.out.getvalue().count("Creating index template"), 3)
+
+    def test_create_index_templates_bulk_load(self):
+        self.cmd._create_index_templates([self.doc_c1], self.options, bulk_load=True)
+        self.index_b.as_template.return_value.settings.assert_called_once_with(
+            **BULK_INDEX_SETTINGS
+        )
+        self.index_b.as_template.return_value.save.assert_called_once()
+
+    def test_restore_index_settings(self):
+        self.index_b.settings(number_of_replicas=2, translog={'durability': 'async'})
+        es = Mock()
+        self.cmd._restore_index_settings(es, [self.doc_c1], [self.index_b], self.options)
+        self.index_b.as_template.return_value.settings.assert_not_called()
+        self.index_b.as_template.return_value.save.assert_called_once()
+        # Settings the index doesn't define are reset
+        es.indices.put_settings.assert_called_once_with(index='123-bar-*', body={'index': {
+            'refresh_interval': None,
+            'number_of_replicas': 2,
+            'translog.durability': 'async',
+            'translog.flush_threshold_size': None,
+        }})
+
+    def test_get_index_setting(self):
+        self.assertEqual(_get_index_setting({'translog.durability': 'a'}, 'translog.durability'), 'a')
+        self.assertEqual(_get_index_setting({'translog': {'durability': 'a'}}, 'translog.durability'), 'a')
+        self.assertEqual(
+            _get_index_setting({'index': {'translog': {'durability': 'a'}}}, 'translog.durability'), 'a'
+        )
+        self.assertEqual(_get_index_setting({'index.refresh_interval': '5s'}, 'refresh_interval'), '5s')
+        self.assertEqual(_get_index_setting({'index': {'refresh_interval': '5s'}}, 'refresh_interval'), '5s')
+        self.assertIsNone(_get_index_setting({'translog': {}}, 'translog.durability'))
+
+    def test_create_index_templates_raises_worker_errors(self):
+        self.index_b.as_template.return_value.save.side_effect = ValueError
+        with self.assertRaises(ValueError):
+            self.cmd._create_index_templates([self.doc_c1], self.options)
+
+    def test_reindex_as_new(self):
+        indexed = {}
+        for doc in [self.doc_a1, self.doc_b1, self.doc_c1]:
+            doc.get_queryset.return_value.iterator.return_value = iter(range(1200))
+            doc.update.side_effect = lambda qs, **kwargs: indexed.setdefault(
+                qs, (list(qs), kwargs)
+            )
+
+        self.cmd._reindex_as_new(
+            Mock(), [self.doc_a1, self.doc_b1, self.doc_c1], self.options
+        )
+        self.assertEqual(len(indexed), 3)
+        for objects, kwargs in indexed.values():
+            self.assertEqual(objects, list(range(1200)))
+            self.assertEqual(
+                kwargs, {'parallel': False, 'index_base_id': 123, 'refresh': False}
+            )
+        self.assertEqual(self.out.getvalue().count("Indexing"), 3)
+
+    def test_reindex_as_new_bulk_sizes(self):
+        self.options['chunk_size'] = 100
+        self.options['max_chunk_bytes'] = 1024
+        self.cmd._reindex_as_new(Mock(), [self.doc_c1], self.options)
+        self.doc_c1_qs.iterator.assert_called_once_with(chunk_size=100)
+        self.assertEqual(self.doc_c1.update.call_args[1], {
+            'parallel': False,
+            'index_base_id': 123,
+            'chunk_size': 100,
+            'max_chunk_bytes': 1024,
+            'refresh': False,
+        })
+
+    def test_reindex_as_new_parallel(self):
+        self.options['parallel'] = True
+        self.cmd._reindex_as_new(Mock(), [self.doc_c1], self.options)
+        self.assertEqual(self.doc_c1.update.call_args[1], {
+            'parallel': True,
+            'index_base_id': 123,
+            'thread_count': 8,
+            'queue_size': 4,
+            'refresh': False,
+        })
+
+    def test_reindex_as_new_closes_old_connections(self):
+        self.doc_c1.update.side_effect = ValueError
+        module = 'django_elasticsearch_dsl.management.commands.es_reindex'
+        with patch(module + '.close_old_connections') as close_old_connections, patch(
+            module + '.db_connections'
+        ) as db_connections:
+            with self.assertRaises(ValueError):
+                self.cmd._reindex_as_new(Mock(), [self.doc_c1], self.options)
+        # Stale connections are dropped on entry, and all of them closed on exit
+        close_old_connections.assert_called_once_with()
+        db_connections.close_all.assert_called_once_with()
+
+    def test_reindex_as_new_no_bulk_index_settings(self):
+        self.options['bulk_index_settings'] = False
+        self.cmd._reindex_as_new(Mock(), [self.doc_c1], self.options)
+        # The document's auto_refresh decides
+        self.assertNotIn('refresh', self.doc_c1.update.call_args[1])
+
+    def test_wait_for_replicas(self):
+        es = Mock()
+        es.cluster.health.return_value = {'timed_out': False}
+        self.cmd._wait_for_replicas(es, self.options)
+        self.assertEqual(es.cluster.health.call_args[1]['index'], '123-*')
+        self.assertTrue(es.cluster.health.call_args[1]['wait_for_no_initializing_shards'])
+
+    def test_reindex_as_new_raises_queryset_errors(self):
+        def failing_iterator():
+            yield 1
+            raise ValueError
+        self.doc_c1.get_queryset.return_value.iterator.return_value = failing_iterator()
+        self.doc_c1.update.side_effect = lambda qs, **kwargs: list(qs)
+        with self.assertRaises(ValueError):
+            self.cmd._reindex_as_new(Mock(), [self.doc_c1], self.options)
+
+    def test_reindex_as_new_no_count(self):
+        self.options['count'] = False
+        self.cmd._reindex_as_new(Mock(), [self.doc_c1], self.options)
+        # Only the indexing queryset is built, no COUNT query is issued
+        self.doc_c1.get_queryset.assert_called_once()
+        self.doc_c1.get_queryset.return_value.count.assert_not_called()
+        self.assertIn("Indexing all 'ModelC' objects", self.out.getvalue())
+
+    def _mock_es(self, aliases):
+        es = Mock()
+        es.indices.get_alias.return_value = {
+            index: {'aliases': dict((alias, {}) for alias in index_aliases)}
+            for index, index_aliases in aliases.items()
+        }
+        return es
+
+    def test_update_wildcard_indexes_wipes_old_indexes(self):
+        aliases = {
+            '100-foo-a': set(['foo_r_wildcard']),
+            '100-foo-b': set(['foo_r_wildcard']),
+            '123-foo-a': set(),
+        }
+        actions = self.cmd._update_wildcard_indexes(self.index_a, aliases, self.options)
+        self.assertEqual(actions, [
+            {'add': {'alias': 'foo_r_wildcard', 'index': '123-foo-*'}},
+            {'remove_index': {'index': '100-foo-a'}},
+            {'remove_index': {'index': '100-foo-b'}},
+        ])
+        self.assertEqual(aliases, {'123-foo-a': set(['foo_r_wildcard'])})
+
+    def test_update_wildcard_indexes_keeps_old_indexes(self):
+        self.options['wipe_old_indexes'] = False
+        aliases = {'100-foo-a': set(['foo_r_wildcard']), '123-foo-a': set()}
+        actions = self.cmd._update_wildcard_indexes(self.index_a, aliases, self.options)
+        self.assertEqual(actions, [
+            {'remove': {'alias': 'foo_r_wildcard', 'indices': ['100-foo-a']}},
+            {'add': {'alias': 'foo_r_wildcard', 'index': '123-foo-*'}},
+        ])
+        self.assertEqual(aliases, {'100-foo-a': set(), '123-foo-a': set(['foo_r_wildcard'])})
+
+    def test_update_alias_one_request_per_index(self):
+        es = self._mock_es({
+            '100-foo-a': ['foo_r_wildcard', 'foo_r-a'],
+            '123-foo-a': [],
+            '123-foo-b': [],
+            '123-bar-a': [],
+        })
+        self.cmd._update_alias(es, [self.index_a, self.index_b], self.options)
+        es.indices.get_alias.assert_called_once_with()
+        actions = [
+            call[1]['body']['actions'] for call in es.indices.update_aliases.call_args_list
+        ]
+        # The old index and its fixed alias go in the same request as the new aliases,
+        # there is nothing to remove from the wiped index
+        self.assertIn([
+            {'add': {'alias': 'foo_r_wildcard', 'index': '123-foo-*'}},
+            {'add': {'alias': 'foo_r-a', 'index': '123-foo-a'}},
+            {'add': {'alias': 'foo_r-b', 'index': '123-foo-b'}},
+            {'remove_index': {'index': '100-foo-a'}},
+        ], actions)
+        self.assertIn([
+            {'add': {'alias': 'bar_r_wildcard', 'index': '123-bar-*'}},
+            {'add': {'alias': 'bar_r-a', 'index': '123-bar-a'}},
+        ], actions)
+        self.assertEqual(len(actions), 2)
+
+    def test_update_wildcard_indexes_new_alias(self):
+        aliases = {'123-foo-a': set()}
+        actions = self.cmd._update_wildcard_indexes(self.index_a, aliases, self.options)
+        self.assertEqual(actions, [{'add': {'alias': 'foo_r_wildcard', 'index': '123-foo-*'}}])
+        self.assertEqual(aliases, {'123-foo-a': set(['foo_r_wildcard'])})
+
+    def test_update_wildcard_indexes_replay_errors_not_swallowed(self):
+        aliases = {'100-foo-a': set(['foo_r_wildcard'])}
+        with patch.object(self.cmd, '_apply_alias_actions', side_effect=KeyError('boom')):
+            with self.assertRaises(KeyError):
+                self.cmd._update_wildcard_indexes(self.index_a, aliases, self.options)
+
+    def test_update_wildcard_indexes_ignores_current_indexes(self):
+        aliases = {
+            '100-foo-a': set(['foo_r_wildcard']),
+            '123-foo-a': set(['foo_r_wildcard']),
+        }
+        actions = self.cmd._update_wildcard_indexes(self.index_a, aliases, self.options)
+        self.assertEqual(actions, [
+            {'add': {'alias': 'foo_r_wildcard', 'index': '123-foo-*'}},
+            {'remove_index': {'index': '100-foo-a'}},
+        ])
+
+    def test_update_alias_index_base_id_prefix_of_another(self):
+        self.options['index_base_id'] = 12
+        self.options['index_base_id_prefix'] = '12-'
+        es = self._mock_es({
+            '123-bar-a': ['bar_r_wildcard', 'bar_r-a'],
+            '12-bar-a': [],
+        })
+        self.cmd._update_alias(es, [self.index_b], self.options)
+        # The indexes of id 123 are old ones for id 12, not current ones
+        es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'add': {'alias': 'bar_r_wildcard', 'index': '12-bar-*'}},
+            {'add': {'alias': 'bar_r-a', 'index': '12-bar-a'}},
+            {'remove_index': {'index': '123-bar-a'}},
+        ]})
+
+    def test_update_wildcard_indexes_already_current(self):
+        aliases = {'123-foo-a': set(['foo_r_wildcard'])}
+        actions = self.cmd._update_wildcard_indexes(self.index_a, aliases, self.options)
+        self.assertEqual(actions, [])
+        self.assertIn("skipping Alias update", self.out.getvalue())
+
+    def test_update_alias_moves_fixed_aliases_from_snapshot(self):
+        self.options['wipe_old_indexes'] = False
+        es = self._mock_es({
+            '100-bar-a': ['bar_r_wildcard', 'bar_r-a'],
+            '100-bar-b': ['bar_r_wildcard', 'bar_r-b'],
+            '100-bar-c': ['bar_r_wildcard', 'bar_r-c'],
+            '123-bar-a': [],
+            '123-bar-b': [],
+            '123-bar-c': [],
+        })
+        self.cmd._update_alias(es, [self.index_b], self.options)
+        # One lookup no matter how many fixed aliases there are
+        es.indices.get_alias.assert_called_once_with()
+        # The wildcard and all the fixed aliases move in a single request
+        expected = [
+            {'remove': {'alias': 'bar_r_wildcard', 'indices': ['100-bar-a', '100-bar-b', '100-bar-c']}},
+            {'add': {'alias': 'bar_r_wildcard', 'index': '123-bar-*'}},
+        ]
+        for postfix in 'abc':
+            expected.extend([
+                {'remove': {'alias': 'bar_r-' + postfix, 'indices': ['100-bar-' + postfix]}},
+                {'add': {'alias': 'bar_r-' + postfix, 'index': '123-bar-' + postfix}},
+            ])
+        es.indices.update_aliases.assert_called_once_with(body={'actions': expected})
+
+    def test_update_alias_already_current(self):
+        es = self._mock_es({
+            '123-bar-a': ['bar_r_wildcard', 'bar_r-a'],
+            '123-bar-b': ['bar_r_wildcard'],
+        })
+        self.cmd._update_alias(es, [self.index_b], self.options)
+        # Only the missing fixed alias is written
+        es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'add': {'alias': 'bar_r-b', 'index': '123-bar-b'}},
+        ]})
+
+        es = self._mock_es({'123-bar-a': ['bar_r_wildcard', 'bar_r-a']})
+        self.cmd._update_alias(es, [self.index_b], self.options)
+        es.indices.update_aliases.assert_not_called()
+
+    @skipIf(orjson is None, "orjson is not installed")
+    def test_orjson_serializer(self):
+        serializer = ORJSONSerializer(AttrJSONSerializer())
+        self.assertEqual(serializer.dumps('{"a":1}'), '{"a":1}')
+        self.assertEqual(
+            serializer.dumps({'date': datetime.date(2020, 1, 2), 'price': Decimal('1.5'), 1: 'a'}),
+            '{"date":"2020-01-02","price":1.5,"1":"a"}'
+        )
+
+    @skipIf(orjson is None, "orjson is not installed")
+    def test_orjson_serializer_attr_list(self):
+        serializer = ORJSONSerializer(AttrJSONSerializer())
+        self.assertEqual(serializer.dumps({'x': AttrList([1, 2])}), '{"x":[1,2]}')
+
+    @skipIf(orjson is None, "orjson is not installed")
+    def test_orjson_serializer_to_dict(self):
+        class Inner(InnerDoc):
+            a = Keyword()
+
+        serializer = ORJSONSerializer(AttrJSONSerializer())
+        self.assertEqual(serializer.dumps({'x': Inner(a='b')}), '{"x":{"a":"b"}}')
+
+    @skipIf(orjson is None, "orjson is not installed")
+    def test_bulk_serializer(self):
+        es = Mock()
+        serializer = es.transport.serializer = AttrJSONSerializer()
+        with self.cmd._bulk_serializer(es, self.options):
+            self.assertIsInstance(es.transport.serializer, ORJSONSerializer)
+            self.assertIs(es.transport.serializer._serializer, serializer)
+        self.assertIs(es.transport.serializer, serializer)
+
+        self.options['orjson'] = False
+        with self.cmd._bulk_serializer(es, self.options):
+            self.assertIs(es.transport.serializer, serializer)
+
+    @skipIf(orjson is None, "orjson is not installed")
+    def test_bulk_serializer_keeps_custom_serializer(self):
+        class CustomSerializer(AttrJSONSerializer):
+            pass
+
+        es = Mock()
+        serializer = es.transport.serializer = CustomSerializer()
+        with self.cmd._bulk_serializer(es, self.options):
+            self.assertIs(es.transport.serializer, serializer)
+
+    # The steps of the command, in the order handle() runs them
+    handle_steps = [
+        '_create_index_templates',
+        '_reindex_as_new',
+        '_refresh_new_indexes',
+        '_force_merge_new_indexes',
+        '_restore_index_settings',
+        '_wait_for_replicas',
+        '_update_alias',
+    ]
+
+    def _patch_handle_steps(self):
+        """
+        Mock out the elasticsearch connection and every step of handle(), the
+        patches are stopped by the cleanup registered in setUp
+        """
+        patch('django_elasticsearch_dsl.management.commands.es_reindex.connections').start()
+        return patch.multiple(
+            EsReindexCommand, **dict((step, DEFAULT) for step in self.handle_steps)
+        ).start()
+
+    def test_handle(self):
+        manager = Mock()
+        handles = self._patch_handle_steps()
+        for name, handle in handles.items():
+            manager.attach_mock(handle, name)
+        call_command('es_reindex', stdout=self.out, index_base_id='123', models=['bar'])
+        self.assertEqual([call[0] for call in manager.mock_calls], self.handle_steps)
+        self.assertTrue(handles['_create_index_templates'].call_args[1]['bulk_load'])
+        # The registry is resolved once and shared by every step
+        self.assertEqual(handles['_create_index_templates'].call_args[0][0], [self.doc_c1])
+        self.assertEqual(handles['_reindex_as_new'].call_args[0][1], [self.doc_c1])
+        self.assertEqual(handles['_update_alias'].call_args[0][1], [self.index_b])
+
+    def test_handle_no_bulk_index_settings(self):
+        handles = self._patch_handle_steps()
+        call_command(
+            'es_reindex', '--no-bulk-index-settings', '--no-force-merge', stdout=self.out
+        )
+        self.assertFalse(handles['_create_index_templates'].call_args[1]['bulk_load'])
+        handles['_restore_index_settings'].assert_not_called()
+        handles['_refresh_new_indexes'].assert_not_called()
+        handles['_force_merge_new_indexes'].assert_not_called()
+        handles['_wait_for_replicas'].assert_not_called()
+
+    def test_force_merge_new_indexes(self):
+        es = Mock()
+        self.cmd._force_merge_new_indexes(es, self.options)
+        es.indices.forcemerge.assert_called_once_with(
+            index='123-*', max_num_segments=1, request_timeout=60
+        )
+
+    def test_force_merge_new_indexes_timeout(self):
+        es = Mock()
+        es.indices.forcemerge.side_effect = ConnectionTimeout('TIMEOUT', 'timed out', None)
+        err = StringIO()
+        cmd = EsReindexCommand(stdout=self.out, stderr=err)
+        cmd._force_merge_new_indexes(es, self.options)
+        self.assertIn("Timed out waiting for the force merge", err.getvalue())
+
+    def test_handle_index_base_id_defaults_to_now(self):
+        handles = self._patch_handle_steps()
+        with patch(
+            'django_elasticsearch_dsl.management.commands.es_reindex.timezone'
+        ) as timezone:
+            timezone.now.return_value.timestamp.return_value = 100.5
+            call_command('es_reindex', stdout=self.out)
+            timezone.now.return_value.timestamp.return_value = 200.5
+            call_command('es_reindex', stdout=self.out)
+        options = [call[0][2] for call in handles['_reindex_as_new'].call_args_list]
+        self.assertEqual([o['index_base_id'] for o in options], [100, 200])
+        self.assertEqual([o['index_base_id_prefix'] for o in options], ['100-', '200-'])
@@ -100,6 +100,20 @@ class DocTypeTestCase(TestCase):
         self.assertIsNone(CarDocument.django.queryset_pagination)
         self.assertEqual(CarDocument2.django.queryset_pagination, 120)
 
+    def test_get_indexing_queryset_chunk_size(self):
+        @registry.register_document
+        class CarDocument2(DocType):
+            class Django:
+                model = Car
+                queryset_pagination = 120
+
+        doc = CarDocument2()
+        with patch.object(CarDocument2, 'get_queryset') as mock_qs:
+            doc.get_indexing_queryset()
+            mock_qs.return_value.iterator.assert_called_with(chunk_size=120)
+            doc.get_indexing_queryset(chunk_size=500)
+            mock_qs.return_value.iterator.assert_called_with(chunk_size=500)
+
     def test_fields_populated(self):
         mapping = CarDocument._doc_type.mapping
         self.assertEqual(